@@ -8,25 +8,87 @@ CSV文件导入SQLite数据库脚本
 import os
 import sqlite3
 import pandas as pd
-import glob
 from datetime import datetime
 import logging
+import multiprocessing
+import queue
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+except ImportError:
+    pa = None
+    pacsv = None
 
 # 配置日志
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S',
+)
 logger = logging.getLogger(__name__)
 
+# 子进程中每次从CSV读取的行数
+CHUNK_SIZE = 50_000
+# PyArrow每次读取的数据块大小（字节）
+ARROW_BLOCK_SIZE = 1 << 20
+# 等待子进程回传数据的轮询间隔（秒）
+QUEUE_POLL_INTERVAL = 1
+# 浮点列转换为整数列时允许的最大绝对值（超过后浮点数无法精确表示整数）
+MAX_SAFE_INTEGER = 2 ** 53
+
+# SQLite csv虚拟表扩展（可为扩展文件的完整路径）
+CSV_EXTENSION = os.environ.get("SQLITE_CSV_EXTENSION", "csv")
+# 建表前推断列类型时，每个文件采样的行数
+TYPE_SAMPLE_ROWS = 10_000
+
+# 导入完成后创建的索引：(索引名, 列名)
+INDEXED_COLUMNS = (
+    ("idx_stat_date", "stat_date"),
+    ("idx_zone", "gccxbigzone_name"),
+)
+
+# 视为空值的文本，pandas、PyArrow和csv虚拟表三种导入方式统一使用
+NULL_VALUES = [
+    "", "#N/A", "#N/A N/A", "#NA", "-1.#IND", "-1.#QNAN", "-NaN", "-nan",
+    "1.#IND", "1.#QNAN", "<NA>", "N/A", "NA", "NULL", "NaN", "None",
+    "n/a", "nan", "null",
+]
+
+# 布尔列中按pandas规则识别的真假值文本
+BOOL_LITERALS = {
+    "True": 1, "TRUE": 1, "true": 1,
+    "False": 0, "FALSE": 0, "false": 0,
+}
+
+# 子进程中回传解析结果的队列
+_batch_queue = None
+
+# 批量导入连接使用的PRAGMA设置（page_size必须在建表之前设置）
+BULK_LOAD_PRAGMAS = (
+    "PRAGMA page_size=8192",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=OFF",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=30000000000",
+    "PRAGMA cache_size=-200000",
+)
+
 def create_database():
     """创建数据库连接"""
     db_name = "客户数据.db"
     
-    # 如果数据库已存在，删除它
-    if os.path.exists(db_name):
-        os.remove(db_name)
-        logger.info(f"已删除现有数据库文件: {db_name}")
+    # 如果数据库已存在，删除它（连同WAL模式留下的-wal/-shm文件）
+    for path in (db_name, f"{db_name}-wal", f"{db_name}-shm"):
+        if os.path.exists(path):
+            os.remove(path)
+            logger.info(f"已删除现有数据库文件: {path}")
     
     # 创建新的数据库连接
     conn = sqlite3.connect(db_name)
+    for pragma in BULK_LOAD_PRAGMAS:
+        conn.execute(pragma)
     logger.info(f"已创建新数据库: {db_name}")
     
     return conn
@@ -34,57 +96,373 @@ def create_database():
 def get_csv_files():
     """获取所有CSV文件"""
     csv_dir = "已脱敏"
-    csv_pattern = os.path.join(csv_dir, "*.csv")
-    csv_files = glob.glob(csv_pattern)
+    
+    try:
+        with os.scandir(csv_dir) as entries:
+            csv_files = sorted(
+                entry.path for entry in entries
+                if entry.name.endswith(".csv") and entry.is_file()
+            )
+    except FileNotFoundError:
+        csv_files = []
     
     logger.info(f"找到 {len(csv_files)} 个CSV文件")
-    for file in csv_files:
-        logger.info(f"  - {file}")
+    if logger.isEnabledFor(logging.DEBUG):
+        for file in csv_files:
+            logger.debug(f"  - {file}")
     
     return csv_files
 
-def import_csv_to_db(conn, csv_files):
-    """将CSV文件导入数据库"""
-    all_dataframes = []
+def get_csv_columns(csv_files):
+    """扫描所有CSV文件的表头，得到按首次出现顺序排列的列名并集"""
+    columns = []
+    seen = set()
     
     for csv_file in csv_files:
         try:
-            logger.info(f"正在读取文件: {csv_file}")
-            
-            # 读取CSV文件
-            df = pd.read_csv(csv_file, encoding='utf-8')
-            
-            logger.info(f"  - 文件大小: {len(df)} 行, {len(df.columns)} 列")
-            logger.info(f"  - 列名: {list(df.columns)}")
-            
-            # 添加到列表中
-            all_dataframes.append(df)
-            
+            header = pd.read_csv(csv_file, encoding='utf-8', nrows=0).columns
+        except Exception as e:
+            logger.error(f"读取文件表头 {csv_file} 时出错: {e}")
+            continue
+        
+        for col in header:
+            if col not in seen:
+                seen.add(col)
+                columns.append(col)
+    
+    return columns
+
+def quote_identifier(name):
+    """为SQLite标识符加双引号"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+def sqlite_type(dtype):
+    """将pandas数据类型映射为SQLite列类型"""
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(dtype):
+        return "REAL"
+    return "TEXT"
+
+def narrow_float_series(series):
+    """浮点列的非空值全部为整数时，转换为整数（空值为None），否则原样返回"""
+    values = series.dropna()
+    if values.empty or not (values % 1 == 0).all() or values.abs().max() > MAX_SAFE_INTEGER:
+        return series
+    return series.map(lambda v: int(v) if pd.notna(v) else None).astype(object)
+
+def create_table(conn, table_name, columns, column_types):
+    """按列名和列类型创建数据表，未知类型的列不声明类型"""
+    column_defs = ", ".join(
+        f"{quote_identifier(col)} {column_types.get(col, '')}".rstrip() for col in columns
+    )
+    conn.execute(f"DROP TABLE IF EXISTS {quote_identifier(table_name)}")
+    conn.execute(f"CREATE TABLE {quote_identifier(table_name)} ({column_defs})")
+
+def insert_rows(conn, table_name, column_count, rows):
+    """使用executemany批量插入数据"""
+    placeholders = ",".join("?" * column_count)
+    conn.executemany(
+        f"INSERT INTO {quote_identifier(table_name)} VALUES ({placeholders})",
+        rows,
+    )
+
+def _init_worker(batch_queue):
+    """进程池初始化函数，设置子进程回传解析结果的队列"""
+    global _batch_queue
+    _batch_queue = batch_queue
+    # 主进程提前结束导入时，队列中可能还有未被读取的数据，
+    # 子进程退出时不等待这些数据写完，避免进程池关闭时卡住
+    batch_queue.cancel_join_thread()
+
+def _iter_batches_arrow(csv_file, columns, bool_columns):
+    """
+    使用PyArrow流式解析CSV文件，逐块返回按列名并集对齐的行元组列表
+    
+    布尔列中的True/False文本转换为1/0，与pandas解析的结果保持一致。
+    """
+    reader = pacsv.open_csv(
+        csv_file,
+        # 并行已由进程池负责，这里不再开启多线程，避免线程数超过CPU核数
+        read_options=pacsv.ReadOptions(block_size=ARROW_BLOCK_SIZE, use_threads=False),
+        # 所有列按文本读取，避免各数据块推断出的类型不一致，类型转换交给目标表的列类型
+        convert_options=pacsv.ConvertOptions(
+            column_types={col: pa.string() for col in columns},
+            null_values=NULL_VALUES,
+            strings_can_be_null=True,
+        ),
+    )
+    
+    for batch in reader:
+        arrays = {}
+        for name, column in zip(batch.schema.names, batch.columns):
+            values = column.to_pylist()
+            if name in bool_columns:
+                values = [BOOL_LITERALS.get(v, v) for v in values]
+            arrays[name] = values
+        empty_column = [None] * batch.num_rows
+        yield list(zip(*(arrays.get(col, empty_column) for col in columns)))
+
+def _iter_batches_pandas(csv_file, columns):
+    """使用pandas分块解析CSV文件（未安装PyArrow时使用），逐块返回按列名并集对齐的行元组列表"""
+    for chunk in pd.read_csv(
+        csv_file, encoding='utf-8', chunksize=CHUNK_SIZE,
+        na_values=NULL_VALUES, keep_default_na=False,
+    ):
+        for col, dtype in chunk.dtypes.items():
+            # 含空值的整数列会被推断为float64，尽量还原为整数
+            if pd.api.types.is_float_dtype(dtype):
+                chunk[col] = narrow_float_series(chunk[col])
+            # 日期时间列以ISO格式文本存储
+            elif pd.api.types.is_datetime64_any_dtype(dtype):
+                chunk[col] = chunk[col].map(lambda v: v.isoformat() if pd.notna(v) else None)
+        
+        chunk = chunk.reindex(columns=columns)
+        yield list(chunk.itertuples(index=False, name=None))
+
+def _read_one_csv(csv_file, columns, bool_columns):
+    """
+    在子进程中流式解析单个CSV文件
+    
+    每解析出一批行元组就放入回传队列（队列已满时阻塞等待），文件结束时
+    放入一条行数据为None的结束标记，出错时在结束标记中附带错误信息。
+    """
+    try:
+        if pacsv is not None:
+            batches = _iter_batches_arrow(csv_file, columns, bool_columns)
+        else:
+            batches = _iter_batches_pandas(csv_file, columns)
+        for rows in batches:
+            _batch_queue.put((csv_file, rows, None))
+    except Exception as e:
+        _batch_queue.put((csv_file, None, str(e)))
+    else:
+        _batch_queue.put((csv_file, None, None))
+
+def parse_csv_files(csv_files, columns, bool_columns):
+    """
+    使用进程池并行解析CSV文件，逐批返回 (文件名, 行元组列表, 错误)
+    
+    子进程通过有界队列回传数据，在途的批次数不超过工作进程数的两倍，以限制内存占用。
+    行元组列表为None表示该文件已解析结束，此时错误非空表示解析失败。
+    """
+    max_workers = os.cpu_count() or 1
+    batch_queue = multiprocessing.Queue(maxsize=max_workers * 2)
+    
+    with ProcessPoolExecutor(
+        max_workers=max_workers, initializer=_init_worker, initargs=(batch_queue,)
+    ) as executor:
+        futures = [executor.submit(_read_one_csv, csv_file, columns, bool_columns) for csv_file in csv_files]
+        remaining = len(futures)
+        
+        try:
+            while remaining:
+                try:
+                    message = batch_queue.get(timeout=QUEUE_POLL_INTERVAL)
+                except queue.Empty:
+                    # 子进程异常退出时不会再有结束标记，直接终止导入
+                    for future in futures:
+                        if future.done() and future.exception() is not None:
+                            raise future.exception()
+                    continue
+                
+                if message[1] is None:
+                    remaining -= 1
+                yield message
+        finally:
+            # 提前结束时取消未开始的任务，并取走队列中的数据，避免子进程阻塞在写队列上
+            for future in futures:
+                future.cancel()
+            while not all(future.done() for future in futures):
+                try:
+                    batch_queue.get(timeout=QUEUE_POLL_INTERVAL)
+                except queue.Empty:
+                    pass
+
+def create_indexes(conn, table_name, columns):
+    """在数据导入完成后为常用过滤列建立索引，并更新统计信息"""
+    for index_name, column in INDEXED_COLUMNS:
+        if column not in columns:
+            continue
+        logger.info(f"正在创建索引 {index_name} ({column})...")
+        conn.execute(
+            f"CREATE INDEX IF NOT EXISTS {quote_identifier(index_name)} "
+            f"ON {quote_identifier(table_name)}({quote_identifier(column)})"
+        )
+    
+    # 收集统计信息，供查询优化器选择索引
+    conn.execute(f"ANALYZE {quote_identifier(table_name)}")
+
+def load_csv_extension(conn):
+    """尝试加载SQLite的csv虚拟表扩展，成功返回True"""
+    try:
+        conn.enable_load_extension(True)
+        try:
+            conn.load_extension(CSV_EXTENSION)
+        finally:
+            conn.enable_load_extension(False)
+    except (AttributeError, sqlite3.Error) as e:
+        # AttributeError: 当前Python的sqlite3模块编译时未开启扩展加载
+        logger.info(f"未能加载SQLite csv扩展，改用Python解析导入: {e}")
+        return False
+    
+    logger.info("已加载SQLite csv扩展")
+    return True
+
+def sample_column_types(csv_files):
+    """
+    读取每个CSV文件的前若干行，推断各列的SQLite类型
+    
+    返回 (列类型字典, 布尔列集合)。布尔列（含空值的也算）声明为INTEGER，按1/0存储。
+    """
+    column_types = {}
+    bool_columns = set()
+    
+    for csv_file in csv_files:
+        try:
+            sample = pd.read_csv(
+                csv_file, encoding='utf-8', nrows=TYPE_SAMPLE_ROWS,
+                na_values=NULL_VALUES, keep_default_na=False,
+            )
         except Exception as e:
             logger.error(f"读取文件 {csv_file} 时出错: {e}")
             continue
+        
+        for col, dtype in sample.dtypes.items():
+            if col in column_types:
+                continue
+            # 含空值的布尔列会被推断为object类型，需要按值判断
+            if pd.api.types.infer_dtype(sample[col], skipna=True) == "boolean":
+                column_types[col] = "INTEGER"
+                bool_columns.add(col)
+                continue
+            if pd.api.types.is_float_dtype(dtype):
+                series = sample[col]
+                if narrow_float_series(series) is not series:
+                    column_types[col] = "INTEGER"
+                    continue
+            column_types[col] = sqlite_type(dtype)
     
-    if not all_dataframes:
+    return column_types, bool_columns
+
+def sql_literal_list(values):
+    """将文本列表转为SQL的 IN (...) 列表"""
+    return "(" + ", ".join("'" + str(v).replace("'", "''") + "'" for v in values) + ")"
+
+def import_csv_via_vtab(conn, table_name, csv_file, bool_columns):
+    """通过csv虚拟表在SQLite内部直接导入单个CSV文件，返回导入行数"""
+    header = pd.read_csv(csv_file, encoding='utf-8', nrows=0).columns
+    filename = csv_file.replace("'", "''")
+    
+    conn.execute(f"CREATE VIRTUAL TABLE temp.csv_import USING csv(filename='{filename}', header=YES)")
+    try:
+        # 虚拟表中的值均为文本，空值文本转为NULL、布尔文本转为1/0，
+        # 与Python解析路径一致，其余类型转换交给目标表的列类型
+        null_list = sql_literal_list(NULL_VALUES)
+        true_list = sql_literal_list(k for k, v in BOOL_LITERALS.items() if v == 1)
+        false_list = sql_literal_list(k for k, v in BOOL_LITERALS.items() if v == 0)
+        values = []
+        for col in header:
+            name = quote_identifier(col)
+            if col in bool_columns:
+                values.append(
+                    f"CASE WHEN {name} IN {null_list} THEN NULL "
+                    f"WHEN {name} IN {true_list} THEN 1 "
+                    f"WHEN {name} IN {false_list} THEN 0 ELSE {name} END"
+                )
+            else:
+                values.append(f"CASE WHEN {name} IN {null_list} THEN NULL ELSE {name} END")
+        target = ", ".join(quote_identifier(col) for col in header)
+        values = ", ".join(values)
+        cursor = conn.execute(
+            f"INSERT INTO {quote_identifier(table_name)} ({target}) "
+            f"SELECT {values} FROM temp.csv_import"
+        )
+        return cursor.rowcount
+    finally:
+        conn.execute("DROP TABLE temp.csv_import")
+
+def import_with_csv_extension(conn, table_name, csv_files, columns):
+    """使用csv虚拟表逐个导入CSV文件，返回已导入文件的 (文件名, 行数) 列表"""
+    imported_files = []
+    
+    column_types, bool_columns = sample_column_types(csv_files)
+    create_table(conn, table_name, columns, column_types)
+    for csv_file in csv_files:
+        try:
+            imported_files.append((csv_file, import_csv_via_vtab(conn, table_name, csv_file, bool_columns)))
+        except Exception as e:
+            logger.error(f"读取文件 {csv_file} 时出错: {e}")
+    
+    return imported_files
+
+def import_with_python(conn, table_name, csv_files, columns):
+    """
+    在子进程中并行解析CSV文件后批量写入，返回已导入文件的 (文件名, 行数) 列表
+    
+    任一文件解析失败时抛出异常，调用方需在同一事务中执行以便整体回滚。
+    """
+    imported_files = []
+    file_rows = {}
+    
+    # 写入前先推断所有列的类型，保证只出现在后续文件中的列也有明确类型
+    column_types, bool_columns = sample_column_types(csv_files)
+    create_table(conn, table_name, columns, column_types)
+    
+    # 解析在子进程中并行进行，写入在主进程中串行进行
+    for csv_file, rows, error in parse_csv_files(csv_files, columns, bool_columns):
+        if rows is not None:
+            insert_rows(conn, table_name, len(columns), rows)
+            file_rows[csv_file] = file_rows.get(csv_file, 0) + len(rows)
+        elif error is not None:
+            # 各文件的数据批次交错写入，出错文件已写入的部分无法单独回滚，
+            # 因此抛出异常终止整个导入，由外层事务全部回滚
+            raise Exception(f"读取文件 {csv_file} 时出错: {error}")
+        else:
+            imported_files.append((csv_file, file_rows.pop(csv_file, 0)))
+    
+    return imported_files
+
+def import_csv_to_db(conn, csv_files):
+    """将CSV文件导入数据库，优先使用SQLite csv扩展，否则并行解析后流式写入"""
+    table_name = "customer_data"
+    
+    # 先扫描表头，得到所有文件的列名并集，保证各文件结构一致
+    columns = get_csv_columns(csv_files)
+    if not columns:
         logger.error("没有成功读取任何CSV文件")
         return False
     
+    logger.info(f"合并后列数: {len(columns)}")
+    
     try:
-        # 合并所有数据
-        logger.info("正在合并所有数据...")
-        combined_df = pd.concat(all_dataframes, ignore_index=True)
+        # 所有数据在同一个事务中写入，避免逐行自动提交；
+        # 显式开始事务，使建表语句也能在出错时一并回滚
+        with conn:
+            conn.execute("BEGIN")
+            if load_csv_extension(conn):
+                imported_files = import_with_csv_extension(conn, table_name, csv_files, columns)
+            else:
+                imported_files = import_with_python(conn, table_name, csv_files, columns)
         
-        logger.info(f"合并后数据大小: {len(combined_df)} 行, {len(combined_df.columns)} 列")
+        if not imported_files:
+            logger.error("没有成功读取任何CSV文件")
+            return False
         
-        # 创建表并导入数据
-        table_name = "customer_data"
-        logger.info(f"正在创建表 {table_name} 并导入数据...")
+        total_rows = sum(file_rows for _, file_rows in imported_files)
+        logger.info(f"已导入 {len(imported_files)} 个文件，共 {total_rows} 行")
+        if logger.isEnabledFor(logging.DEBUG):
+            for csv_file, file_rows in imported_files:
+                logger.debug(f"  - {csv_file}: {file_rows} 行")
         
-        combined_df.to_sql(table_name, conn, if_exists='replace', index=False)
+        # 索引在批量写入之后再建，避免导入过程中逐行维护索引
+        with conn:
+            create_indexes(conn, table_name, columns)
         
         logger.info(f"数据导入成功！")
         logger.info(f"  - 表名: {table_name}")
-        logger.info(f"  - 总行数: {len(combined_df)}")
-        logger.info(f"  - 总列数: {len(combined_df.columns)}")
+        logger.info(f"  - 总行数: {total_rows}")
+        logger.info(f"  - 总列数: {len(columns)}")
         
         return True
         
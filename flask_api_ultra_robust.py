@@ -4,42 +4,238 @@
 Flask API接口 - 超强健版本（处理所有JSON格式问题）
 """
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request
+from werkzeug.exceptions import RequestEntityTooLarge
 import sqlite3
-import pandas as pd
 import os
+import atexit
+import queue
+import threading
+from collections import OrderedDict
+from urllib.parse import quote
 from datetime import datetime
+import time
 import traceback
 import logging
+import ast
 import json
 import re
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
+# 限制请求体大小，避免对超大输入执行JSON修复
+app.config['MAX_CONTENT_LENGTH'] = 1024 * 1024
 
 # 配置数据库连接池
 DATABASE = "客户数据.db"
 
+# 空闲只读连接池
+DB_POOL_SIZE = 8
+_pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+
+# 连接池中连接对应的数据库文件标识
+_db_identity = None
+_db_identity_lock = threading.Lock()
+
+# API连接使用的PRAGMA设置（WAL模式已在建库时持久化到数据库文件中）
+DB_PRAGMAS = (
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=30000000000",
+    "PRAGMA cache_size=-200000",
+    "PRAGMA query_only=ON",
+)
+
+# 只读连接允许的授权动作
+_ALLOWED_ACTIONS = frozenset((
+    sqlite3.SQLITE_SELECT,
+    sqlite3.SQLITE_READ,
+    sqlite3.SQLITE_FUNCTION,
+    sqlite3.SQLITE_RECURSIVE,
+))
+
+# 每次从游标读取的行数
+FETCH_BATCH_SIZE = 1000
+
+# 查询结果缓存：最多缓存的查询数、有效期（秒）和可缓存的最大行数
+QUERY_CACHE_SIZE = 256
+QUERY_CACHE_TTL = 60
+QUERY_CACHE_MAX_ROWS = 10_000
+_query_cache = OrderedDict()
+_query_cache_lock = threading.Lock()
+
+# 健康检查记录数缓存（秒）
+HEALTH_CACHE_TTL = 30
+_health_cache = {"ts": 0, "count": None}
+
+def json_response(obj, status=200):
+    """
+    将对象序列化为JSON响应（优先使用orjson）
+    """
+    if orjson is not None:
+        body = orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    else:
+        body = json.dumps(obj, ensure_ascii=False)
+    return Response(body, status=status, mimetype='application/json')
+
+def read_only_authorizer(action, *args):
+    """
+    SQLite授权回调，只允许查询相关的操作
+    """
+    return sqlite3.SQLITE_OK if action in _ALLOWED_ACTIONS else sqlite3.SQLITE_DENY
+
+class PooledConnection(sqlite3.Connection):
+    """
+    连接池中的数据库连接，记录打开时数据库文件的标识
+    """
+    identity = None
+
+def database_identity():
+    """
+    数据库文件标识，文件被删除重建或修改后会发生变化
+    """
+    st = os.stat(DATABASE)
+    return (st.st_dev, st.st_ino, st.st_mtime_ns)
+
+def check_database_identity():
+    """
+    检查数据库文件是否被重建，是则关闭旧连接并清空缓存，返回当前文件标识
+    """
+    global _db_identity
+    identity = database_identity()
+    if identity != _db_identity:
+        with _db_identity_lock:
+            if identity != _db_identity:
+                if _db_identity is not None:
+                    logger.info("数据库文件已变化，重置连接池和缓存")
+                _db_identity = identity
+                close_db_connections()
+                clear_query_cache()
+                _health_cache["count"] = None
+    return identity
+
 def get_db_connection():
     """
-    获取数据库连接
+    从连接池取出一个只读数据库连接，池为空时新建
     """
     try:
-        conn = sqlite3.connect(DATABASE, timeout=30)
-        conn.row_factory = sqlite3.Row
+        identity = check_database_identity()
+        
+        # 丢弃数据库文件重建前打开的连接
+        while True:
+            try:
+                conn = _pool.get_nowait()
+            except queue.Empty:
+                break
+            if conn.identity == identity:
+                return conn
+            conn.close()
+        
+        uri = f"file:{quote(os.path.abspath(DATABASE))}?mode=ro"
+        conn = sqlite3.connect(
+            uri, uri=True, check_same_thread=False, timeout=30, factory=PooledConnection
+        )
+        conn.identity = identity
+        for pragma in DB_PRAGMAS:
+            conn.execute(pragma)
+        # 在语句编译阶段拒绝任何非只读操作
+        conn.set_authorizer(read_only_authorizer)
         return conn
     except Exception as e:
         logger.error(f"数据库连接失败: {e}")
         raise Exception(f"数据库连接失败: {e}")
 
+def release_db_connection(conn):
+    """
+    将数据库连接放回连接池，池已满或数据库文件已重建时关闭
+    """
+    if conn.identity != _db_identity:
+        conn.close()
+        return
+    try:
+        _pool.put_nowait(conn)
+    except queue.Full:
+        conn.close()
+
+@atexit.register
+def close_db_connections():
+    """
+    进程退出时关闭连接池中的所有连接
+    """
+    while True:
+        try:
+            _pool.get_nowait().close()
+        except queue.Empty:
+            break
+
+def run_query(sql_query):
+    """
+    执行SQL查询，返回所用连接的数据库文件标识、列名和字典形式的行数据
+    
+    分批从游标读取并立即转换为字典，不同时保留元组和字典两份结果。
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.execute(sql_query)
+        columns = [d[0] for d in (cursor.description or [])]
+        data = []
+        while True:
+            rows = cursor.fetchmany(FETCH_BATCH_SIZE)
+            if not rows:
+                break
+            data.extend(dict(zip(columns, row)) for row in rows)
+    finally:
+        release_db_connection(conn)
+    return conn.identity, columns, data
+
+def cached_query(sql_query):
+    """
+    执行SQL查询，结果按SQL文本短时缓存（连接只读，所有查询均可缓存）
+    """
+    # 数据库文件重建后先清空旧的缓存结果
+    check_database_identity()
+    
+    now = time.monotonic()
+    with _query_cache_lock:
+        entry = _query_cache.get(sql_query)
+        if entry is not None and entry[0] > now:
+            _query_cache.move_to_end(sql_query)
+            return entry[1], entry[2]
+    
+    identity, columns, data = run_query(sql_query)
+    
+    # 结果过大时不缓存
+    if len(data) < QUERY_CACHE_MAX_ROWS:
+        with _query_cache_lock:
+            # 查询期间数据库文件被重建时，旧连接的结果不再写入缓存
+            if identity != _db_identity:
+                return columns, data
+            _query_cache[sql_query] = (now + QUERY_CACHE_TTL, columns, data)
+            _query_cache.move_to_end(sql_query)
+            while len(_query_cache) > QUERY_CACHE_SIZE:
+                _query_cache.popitem(last=False)
+    
+    return columns, data
+
+def clear_query_cache():
+    """
+    清空查询结果缓存（数据库内容变化后调用）
+    """
+    with _query_cache_lock:
+        _query_cache.clear()
+
 def execute_sql_query(sql_query):
     """
     执行SQL查询并返回结果
     """
-    conn = None
     try:
         logger.info(f"执行SQL查询: {sql_query[:100]}...")
         
@@ -47,21 +243,13 @@ def execute_sql_query(sql_query):
         if not os.path.exists(DATABASE):
             raise Exception(f"数据库文件不存在: {DATABASE}")
         
-        # 连接数据库
-        conn = get_db_connection()
-        
-        # 执行查询
-        df = pd.read_sql_query(sql_query, conn)
-        
-        # 转换DataFrame为字典列表
-        data = df.to_dict('records')
+        # 执行查询，直接从游标读取列名和数据
+        columns, data = cached_query(sql_query)
         
         # 如果查询结果为空但有列名，创建一行空数据
-        if df.empty and len(df.columns) > 0:
-            empty_row = {col: None for col in df.columns}
-            data = [empty_row]
-            logger.info(f"查询结果为空，创建空行数据，列数: {len(df.columns)}")
-            logger.info(f"空行数据: {empty_row}")
+        if not data and columns:
+            data = [dict.fromkeys(columns)]
+            logger.info(f"查询结果为空，创建空行数据，列数: {len(columns)}")
         else:
             logger.info(f"查询成功，返回 {len(data)} 条记录")
         
@@ -70,7 +258,7 @@ def execute_sql_query(sql_query):
             "error": None,
             "data": data,
             "row_count": len(data),
-            "columns": list(df.columns)
+            "columns": columns
         }
         
     except Exception as e:
@@ -81,9 +269,38 @@ def execute_sql_query(sql_query):
             "error": str(e),
             "data": None
         }
-    finally:
-        if conn:
-            conn.close()
+
+# 匹配 "sql": "..." 字段
+_SQL_FIELD_RE = re.compile(r'"sql":\s*"([^"]*(?:\\.[^"]*)*)"', re.DOTALL)
+# 匹配 "key": "value" 格式，其中value可能包含换行符
+_STRING_FIELD_RE = re.compile(r'"([^"]+)":\s*"([^"]*(?:\n[^"]*)*)"', re.DOTALL)
+
+# JSON字符串中常见控制字符的转义形式
+_CONTROL_ESCAPES = {'\n': '\\n', '\r': '\\r', '\t': '\\t'}
+
+def _sanitize(raw):
+    """
+    单遍扫描原始数据，只转义字符串字面量内部未转义的控制字符
+    """
+    out = []
+    in_string = False
+    escape = False
+    
+    for ch in raw:
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+            elif ch < ' ':
+                ch = _CONTROL_ESCAPES.get(ch) or f'\\u{ord(ch):04x}'
+        elif ch == '"':
+            in_string = True
+        out.append(ch)
+    
+    return ''.join(out)
 
 def fix_json_format(raw_data):
     """
@@ -96,10 +313,15 @@ def fix_json_format(raw_data):
         pass
     
     try:
-        # 方法2: 修复换行符问题 - 更智能的处理
+        # 方法2: 单遍扫描，转义字符串字面量中的控制字符后再解析
+        return json.loads(_sanitize(raw_data))
+    except:
+        pass
+    
+    try:
+        # 方法3: 修复换行符问题 - 更智能的处理
         # 找到sql字段的值，并正确处理其中的换行符
-        sql_pattern = r'"sql":\s*"([^"]*(?:\\.[^"]*)*)"'
-        sql_match = re.search(sql_pattern, raw_data, re.DOTALL)
+        sql_match = _SQL_FIELD_RE.search(raw_data)
         
         if sql_match:
             sql_content = sql_match.group(1)
@@ -112,7 +334,7 @@ def fix_json_format(raw_data):
         pass
     
     try:
-        # 方法3: 更激进的修复 - 处理所有字符串值中的换行符
+        # 方法4: 更激进的修复 - 处理所有字符串值中的换行符
         # 使用正则表达式找到所有字符串值并修复换行符
         def fix_string_value(match):
             key = match.group(1)
@@ -121,16 +343,14 @@ def fix_json_format(raw_data):
             fixed_value = value.replace('\n', '\\n').replace('\r', '\\r')
             return f'"{key}": "{fixed_value}"'
         
-        # 匹配 "key": "value" 格式，其中value可能包含换行符
-        pattern = r'"([^"]+)":\s*"([^"]*(?:\n[^"]*)*)"'
-        fixed_data = re.sub(pattern, fix_string_value, raw_data, flags=re.DOTALL)
+        fixed_data = _STRING_FIELD_RE.sub(fix_string_value, raw_data)
         return json.loads(fixed_data)
     except:
         pass
     
     try:
-        # 方法4: 手动构建JSON - 提取SQL语句
-        sql_match = re.search(r'"sql":\s*"([^"]*(?:\\.[^"]*)*)"', raw_data, re.DOTALL)
+        # 方法5: 手动构建JSON - 提取SQL语句
+        sql_match = _SQL_FIELD_RE.search(raw_data)
         if sql_match:
             sql_content = sql_match.group(1)
             # 清理SQL内容
@@ -140,8 +360,7 @@ def fix_json_format(raw_data):
         pass
     
     try:
-        # 方法5: 使用ast.literal_eval作为最后手段
-        import ast
+        # 方法6: 使用ast.literal_eval作为最后手段
         # 尝试将字符串转换为Python字典
         data_dict = ast.literal_eval(raw_data)
         return data_dict
@@ -155,7 +374,7 @@ def home():
     """
     API首页
     """
-    return jsonify({
+    return json_response({
         "message": "SQL查询API服务",
         "version": "4.0.0",
         "endpoints": {
@@ -171,13 +390,24 @@ def health_check():
     健康检查接口
     """
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM customer_data")
-        count = cursor.fetchone()[0]
-        conn.close()
+        # 记录数在有效期内直接使用缓存，避免每次全表扫描
+        check_database_identity()
+        count = _health_cache["count"]
+        if count is None or time.monotonic() - _health_cache["ts"] >= HEALTH_CACHE_TTL:
+            conn = get_db_connection()
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT COUNT(*) FROM customer_data")
+                count = cursor.fetchone()[0]
+            finally:
+                release_db_connection(conn)
+            # 查询期间数据库文件被重建时，旧连接的记录数不再写入缓存
+            with _db_identity_lock:
+                if conn.identity == _db_identity:
+                    _health_cache["count"] = count
+                    _health_cache["ts"] = time.monotonic()
         
-        return jsonify({
+        return json_response({
             "status": "healthy",
             "database": "connected",
             "total_records": count,
@@ -185,11 +415,11 @@ def health_check():
         })
     except Exception as e:
         logger.error(f"健康检查失败: {e}")
-        return jsonify({
+        return json_response({
             "status": "unhealthy",
             "error": str(e),
             "timestamp": datetime.now().isoformat()
-        }), 500
+        }, 500)
 
 @app.route('/query', methods=['POST'])
 def query_sql():
@@ -199,47 +429,50 @@ def query_sql():
     try:
         logger.info(f"收到POST请求")
         
-        # 获取原始请求数据
-        raw_data = request.get_data(as_text=True)
-        logger.info(f"原始请求数据: {raw_data[:200]}...")
-        
-        # 尝试解析JSON
-        try:
-            data = fix_json_format(raw_data)
-            logger.info("JSON解析成功")
-        except Exception as e:
-            logger.error(f"JSON解析失败: {e}")
-            return jsonify({
-                "success": False,
-                "error": f"JSON格式错误: {str(e)}",
-                "data": None
-            }), 400
+        # 优先按标准JSON解析，失败时才进入修复流程
+        data = request.get_json(force=True, silent=True)
+        if data is None:
+            # 获取原始请求数据
+            raw_data = request.get_data(as_text=True)
+            logger.info(f"原始请求数据: {raw_data[:200]}...")
+            
+            # 尝试修复并解析JSON
+            try:
+                data = fix_json_format(raw_data)
+                logger.info("JSON解析成功")
+            except Exception as e:
+                logger.error(f"JSON解析失败: {e}")
+                return json_response({
+                    "success": False,
+                    "error": f"JSON格式错误: {str(e)}",
+                    "data": None
+                }, 400)
         
         if not data:
             logger.warning("请求体为空")
-            return jsonify({
+            return json_response({
                 "success": False,
                 "error": "请求体不能为空",
                 "data": None
-            }), 400
+            }, 400)
         
         # 获取SQL查询语句
         sql_query = data.get('sql')
         print(sql_query)
         if not sql_query:
             logger.warning("缺少sql参数")
-            return jsonify({
+            return json_response({
                 "success": False,
                 "error": "缺少sql参数",
                 "data": None
-            }), 400
+            }, 400)
         
         
         # 执行查询
         result = execute_sql_query(sql_query)
         
         if result["success"]:
-            return jsonify({
+            return json_response({
                 "success": True,
                 "error": None,
                 "data": result["data"],
@@ -249,45 +482,52 @@ def query_sql():
                 "timestamp": datetime.now().isoformat()
             })
         else:
-            return jsonify({
+            return json_response({
                 "success": False,
                 "error": result["error"],
                 "data": None,
                 "sql": sql_query,
                 "timestamp": datetime.now().isoformat()
-            }), 400
+            }, 400)
             
+    except RequestEntityTooLarge:
+        logger.warning("请求体过大")
+        return json_response({
+            "success": False,
+            "error": "请求体过大",
+            "data": None
+        }, 413)
     except Exception as e:
         logger.error(f"服务器异常: {str(e)}")
         logger.error(f"错误详情: {traceback.format_exc()}")
-        return jsonify({
+        return json_response({
             "success": False,
             "error": f"服务器错误: {str(e)}",
             "data": None,
             "timestamp": datetime.now().isoformat()
-        }), 500
+        }, 500)
 
 @app.errorhandler(404)
 def not_found(error):
     """
     404错误处理
     """
-    return jsonify({
+    return json_response({
         "success": False,
         "error": "接口不存在",
         "data": None
-    }), 404
+    }, 404)
 
 @app.errorhandler(405)
 def method_not_allowed(error):
     """
     405错误处理
     """
-    return jsonify({
+    return json_response({
         "success": False,
         "error": "请求方法不允许",
         "data": None
-    }), 405
+    }, 405)
 
 if __name__ == '__main__':
     print("🚀 启动Flask API服务（超强健版本）...")
@@ -296,6 +536,7 @@ if __name__ == '__main__':
     print("📖 API文档:")
     print("  GET  /health - 健康检查")
     print("  POST /query  - 执行SQL查询")
+    print("⚠️  开发服务器仅供调试，生产环境请使用: gunicorn -k gthread -w $(nproc) --threads 4 wsgi:app")
     print("=" * 50)
     
     app.run(debug=False, host='0.0.0.0', port=5000, threaded=True)
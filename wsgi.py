@@ -0,0 +1,15 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+WSGI入口 - 生产环境使用gunicorn启动Flask API
+
+启动方式:
+    gunicorn -k gthread -w $(nproc) --threads 4 --worker-tmp-dir /dev/shm -b 0.0.0.0:5000 wsgi:app
+
+每个worker进程在首次请求时创建自己的只读数据库连接池。
+"""
+
+from flask_api_ultra_robust import app
+
+if __name__ == '__main__':
+    app.run(debug=False, host='0.0.0.0', port=5000, threaded=True)